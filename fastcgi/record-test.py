@@ -22,36 +22,206 @@
 # 
 
 from __future__ import annotations
-import io, random, unittest
+import asyncio, contextlib, io, random, socket, threading, unittest
+from typing import Callable, Iterator
 from record import *
 
 
+def _unhex(s: str) -> bytes:
+	return bytes.fromhex(s.replace(" ", ""))
+
+
 class RecordTest(unittest.TestCase):
 	
+	# Expected bytes are decoded once at import time rather than in every test run
+	_READ_FROM_STREAM_CASES: list[tuple[bytes,Record|None]] = [
+		(_unhex(""), None),
+		(_unhex("01 01 31DA 0008 00 00 0002010000000000"), BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True, 0)),
+		(_unhex("01 02 70AE 0000 00 00"), AbortRequestRecord(0x70AE, 0)),
+		(_unhex("01 03 4438 0008 00 00 1E30DB1201000000"), EndRequestRecord(0x4438, 0x1E30DB12, EndRequestRecord.ProtocolStatus.CANT_MPX_CONN, 0)),
+		(_unhex("01 04 A8E4 0000 00 00"), ParamsRecord(0xA8E4, b"", 0)),
+		(_unhex("01 05 D79C 0002 00 00 1E25"), StdinRecord(0xD79C, b"\x1E\x25", 0)),
+		(_unhex("01 06 5090 0003 00 00 1F9501"), StdoutRecord(0x5090, b"\x1F\x95\x01", 0)),
+		(_unhex("01 07 14EE 0004 00 00 F89CD8FD"), StderrRecord(0x14EE, b"\xF8\x9C\xD8\xFD", 0)),
+		(_unhex("01 08 9904 0001 00 00 98"), DataRecord(0x9904, b"\x98", 0)),
+		(_unhex("01 09 0000 0013 00 00 058000000044454C54418000000400414C4641"), GetValuesRecord({"DELTA","ALFA"}, 0)),
+		(_unhex("01 0A 0000 001F 00 00 800000050544454C5441627261766F0480000007414C4641436861724C6965"), GetValuesResultRecord({"DELTA":"bravo","ALFA":"CharLie"}, 0)),
+		(_unhex("01 0B 0000 0008 00 00 FF00000000000000"), UnknownTypeRecord(255, 0)),
+		(_unhex("01 FE CA04 0005 03 00 F0E31CF2C6 000000"), CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6", 3)),
+	]
+	
+	_GET_CONTENT_CASES: list[tuple[bytes,Record]] = [
+		(_unhex("0002010000000000"), BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True)),
+		(_unhex(""), AbortRequestRecord(0x70AE, 0)),
+		(_unhex("1E30DB1201000000"), EndRequestRecord(0x4438, 0x1E30DB12, EndRequestRecord.ProtocolStatus.CANT_MPX_CONN)),
+		(_unhex(""), ParamsRecord(0xA8E4, b"")),
+		(_unhex("1E25"), StdinRecord(0xD79C, b"\x1E\x25")),
+		(_unhex("1F9501"), StdoutRecord(0x5090, b"\x1F\x95\x01")),
+		(_unhex("F89CD8FD"), StderrRecord(0x14EE, b"\xF8\x9C\xD8\xFD")),
+		(_unhex("98"), DataRecord(0x9904, b"\x98")),
+		(_unhex("FF00000000000000"), UnknownTypeRecord(255)),
+		(_unhex("F0E31CF2C6"), CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6")),
+	]
+	
+	_TO_BYTES_CASES: list[tuple[bytes,Record]] = [
+		(_unhex("01 01 31DA 0008 00 00 0002010000000000"), BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True, 0)),
+		(_unhex("01 02 70AE 0000 00 00"), AbortRequestRecord(0x70AE, 0)),
+		(_unhex("01 03 4438 0008 00 00 1E30DB1201000000"), EndRequestRecord(0x4438, 0x1E30DB12, EndRequestRecord.ProtocolStatus.CANT_MPX_CONN, 0)),
+		(_unhex("01 04 A8E4 0000 00 00"), ParamsRecord(0xA8E4, b"", 0)),
+		(_unhex("01 05 D79C 0002 00 00 1E25"), StdinRecord(0xD79C, b"\x1E\x25", 0)),
+		(_unhex("01 06 5090 0003 00 00 1F9501"), StdoutRecord(0x5090, b"\x1F\x95\x01", 0)),
+		(_unhex("01 07 14EE 0004 00 00 F89CD8FD"), StderrRecord(0x14EE, b"\xF8\x9C\xD8\xFD", 0)),
+		(_unhex("01 08 9904 0001 00 00 98"), DataRecord(0x9904, b"\x98", 0)),
+		(_unhex("01 0B 0000 0008 00 00 FF00000000000000"), UnknownTypeRecord(255, 0)),
+		(_unhex("01 FE CA04 0005 03 00 F0E31CF2C6 000000"), CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6", 3)),
+	]
+	
+	
 	def test_read_from_stream(self) -> None:
-		CASES: list[tuple[str,Record|None]] = [
-			("", None),
-			("01 01 31DA 0008 00 00 0002010000000000", BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True, 0)),
-			("01 02 70AE 0000 00 00", AbortRequestRecord(0x70AE, 0)),
-			("01 03 4438 0008 00 00 1E30DB1201000000", EndRequestRecord(0x4438, 0x1E30DB12, EndRequestRecord.ProtocolStatus.CANT_MPX_CONN, 0)),
-			("01 04 A8E4 0000 00 00", ParamsRecord(0xA8E4, b"", 0)),
-			("01 05 D79C 0002 00 00 1E25", StdinRecord(0xD79C, b"\x1E\x25", 0)),
-			("01 06 5090 0003 00 00 1F9501", StdoutRecord(0x5090, b"\x1F\x95\x01", 0)),
-			("01 07 14EE 0004 00 00 F89CD8FD", StderrRecord(0x14EE, b"\xF8\x9C\xD8\xFD", 0)),
-			("01 08 9904 0001 00 00 98", DataRecord(0x9904, b"\x98", 0)),
-			("01 09 0000 0013 00 00 058000000044454C54418000000400414C4641", GetValuesRecord({"DELTA","ALFA"}, 0)),
-			("01 0A 0000 001F 00 00 800000050544454C5441627261766F0480000007414C4641436861724C6965", GetValuesResultRecord({"DELTA":"bravo","ALFA":"CharLie"}, 0)),
-			("01 0B 0000 0008 00 00 FF00000000000000", UnknownTypeRecord(255, 0)),
-			("01 FE CA04 0005 03 00 F0E31CF2C6 000000", CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6", 3)),
-		]
-		for (inhex, expect) in CASES:
-			inhex = inhex.replace(" ", "")
-			b: bytes = bytes.fromhex(inhex)
+		for (b, expect) in RecordTest._READ_FROM_STREAM_CASES:
 			inp: io.BufferedIOBase = io.BytesIO(b)
 			actual: Record|None = Record.read_from_stream(inp)
 			self.assertEqual(actual, expect)
 	
 	
+	def test_read_nonzero_reserved_bytes(self) -> None:
+		CASES: list[tuple[bytes,Record]] = [
+			(_unhex("01 01 0001 0008 00 00 000101AABBCCDDEE"), BeginRequestRecord(1, BeginRequestRecord.Role.RESPONDER, True)),
+			(_unhex("01 03 4438 0008 00 00 1E30DB1201AABBCC"), EndRequestRecord(0x4438, 0x1E30DB12, EndRequestRecord.ProtocolStatus.CANT_MPX_CONN)),
+		]
+		for (b, expect) in CASES:
+			for actual in (Record.read_from_stream(io.BytesIO(b)), type(expect).parse_content(expect.get_request_id(), b[8 : ], 0)):
+				assert actual is not None
+				self.assertEqual(actual, expect)
+				self.assertEqual(actual.get_content(), expect.get_content())
+				self.assertEqual(actual.to_bytes(), expect.to_bytes())
+	
+	
+	def test_read_all_from_bytes(self) -> None:
+		cases: list[tuple[bytes,Record]] = [(b, rec) for (b, rec) in RecordTest._READ_FROM_STREAM_CASES if (rec is not None)]
+		self.assertEqual(Record.read_all_from_bytes(b""), [])
+		self.assertEqual(Record.read_all_from_bytes(b"".join(b for (b, _) in cases)), [rec for (_, rec) in cases])
+		for (b, _) in cases:
+			self.assertRaises(EOFError, lambda: Record.read_all_from_bytes(b + b[ : -1]))
+	
+	
+	def test_read_from_stream_reader(self) -> None:
+		RECORDS: list[Record] = [
+			BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True, 0),
+			ParamsRecord(0x31DA, random.randbytes(6000), 7),
+			EndRequestRecord(0x4438, 0x1E30DB12, EndRequestRecord.ProtocolStatus.CANT_MPX_CONN, 0),
+			CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6", 3),
+		]
+		async def run() -> None:
+			reader: asyncio.StreamReader = asyncio.StreamReader()
+			reader.feed_data(b"".join(rec.to_bytes() for rec in RECORDS))
+			reader.feed_eof()
+			for expect in RECORDS:
+				self.assertEqual(await Record.read_from_stream_reader(reader), expect)
+			self.assertIsNone(await Record.read_from_stream_reader(reader))
+			
+			reader = asyncio.StreamReader()
+			reader.feed_data(RECORDS[0].to_bytes()[ : -1])
+			reader.feed_eof()
+			with self.assertRaises(EOFError):
+				await Record.read_from_stream_reader(reader)
+			
+			a, b = socket.socketpair()
+			with a, b:
+				_, writer = await asyncio.open_connection(sock=a)
+				for rec in RECORDS:
+					await rec.send_to_stream_writer(writer)
+				writer.close()
+				await writer.wait_closed()
+				reader, writer = await asyncio.open_connection(sock=b)
+				for expect in RECORDS:
+					self.assertEqual(await Record.read_from_stream_reader(reader), expect)
+				self.assertIsNone(await Record.read_from_stream_reader(reader))
+				writer.close()
+				await writer.wait_closed()
+		asyncio.run(run())
+	
+	
+	def test_read_from_socket(self) -> None:
+		RECORDS: list[Record] = [
+			BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True, 0),
+			ParamsRecord(0x31DA, random.randbytes(60000), 7),
+			EndRequestRecord(0x4438, 0x1E30DB12, EndRequestRecord.ProtocolStatus.CANT_MPX_CONN, 0),
+			CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6", 3),
+		]
+		data: bytes = b"".join(rec.to_bytes() for rec in RECORDS)
+		with _receiving_socket(lambda sock: sock.sendall(data)) as sock:
+			for expect in RECORDS:
+				self.assertEqual(Record.read_from_socket(sock), expect)
+			self.assertIsNone(Record.read_from_socket(sock))
+		
+		for cut in (3, Record._HEADER_STRUCT.size + 100):  # Truncated header, truncated body
+			with _receiving_socket(lambda sock: sock.sendall(RECORDS[1].to_bytes()[ : cut])) as sock:
+				with self.assertRaises(EOFError):
+					Record.read_from_socket(sock)
+	
+	
+	def test_record_stream(self) -> None:
+		RECORDS: list[Record] = [
+			BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True, 0),
+			ParamsRecord(0x31DA, random.randbytes(60000), 7),
+			StdinRecord(0x31DA, random.randbytes(65535), 255),
+			StdinRecord(0x31DA, b"", 0),
+			CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6", 3),
+		] + [StdoutRecord(1, random.randbytes(random.randrange(300)), random.randrange(8)) for _ in range(100)]
+		data: bytes = b"".join(rec.to_bytes() for rec in RECORDS)
+		with _receiving_socket(lambda sock: sock.sendall(data)) as sock:
+			stream: RecordStream = RecordStream(sock)
+			for expect in RECORDS:
+				self.assertEqual(stream.read(), expect)
+			self.assertIsNone(stream.read())
+	
+	
+	def test_send_to_socket(self) -> None:
+		RECORDS: list[Record] = [
+			BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True, 0),
+			AbortRequestRecord(0x70AE, 9),
+			StdoutRecord(0x5090, random.randbytes(65535), 255),
+			StdoutRecord(0x5090, b"", 0),
+			CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6", 3),
+		]
+		def send(sock: socket.socket) -> None:
+			for rec in RECORDS:
+				rec.send_to_socket(sock)
+		self.assertEqual(_transfer(send), b"".join(rec.to_bytes() for rec in RECORDS))
+	
+	
+	def test_buffered_record_writer(self) -> None:
+		RECORDS: list[Record] = [StdoutRecord(1, random.randbytes(random.randrange(3000)), random.randrange(8)) for _ in range(100)]
+		def send(sock: socket.socket) -> None:
+			writer: BufferedRecordWriter = BufferedRecordWriter(sock, 10000)
+			for rec in RECORDS:
+				writer.write(rec)
+			writer.flush()
+		self.assertEqual(_transfer(send), b"".join(rec.to_bytes() for rec in RECORDS))
+	
+	
+	def test_buffered_record_writer_partial_sends(self) -> None:
+		class TrickleSocket:  # Accepts at most 1000 bytes per call
+			data: bytearray
+			def __init__(self) -> None:
+				self.data = bytearray()
+			def sendmsg(self, bufs: list[memoryview]) -> int:
+				b: bytes = b"".join(bufs)[ : 1000]
+				self.data += b
+				return len(b)
+			def sendall(self, b: bytes) -> None:
+				self.data += b
+		
+		RECORDS: list[Record] = [StdoutRecord(1, random.randbytes(random.randrange(5000)), random.randrange(8)) for _ in range(30)]
+		sock: TrickleSocket = TrickleSocket()
+		writer: BufferedRecordWriter = BufferedRecordWriter(sock, 3000)
+		for rec in RECORDS:
+			writer.write(rec)
+		writer.flush()
+		self.assertEqual(bytes(sock.data), b"".join(rec.to_bytes() for rec in RECORDS))
+	
+	
 	def test_construct_request_id_non_zero(self) -> None:
 		CASES: list[int] = [
 			1,
@@ -167,21 +337,7 @@ class RecordTest(unittest.TestCase):
 	
 	
 	def test_get_content(self) -> None:
-		CASES: list[tuple[str,Record]] = [
-			("0002010000000000", BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True)),
-			("", AbortRequestRecord(0x70AE, 0)),
-			("1E30DB1201000000", EndRequestRecord(0x4438, 0x1E30DB12, EndRequestRecord.ProtocolStatus.CANT_MPX_CONN)),
-			("", ParamsRecord(0xA8E4, b"")),
-			("1E25", StdinRecord(0xD79C, b"\x1E\x25")),
-			("1F9501", StdoutRecord(0x5090, b"\x1F\x95\x01")),
-			("F89CD8FD", StderrRecord(0x14EE, b"\xF8\x9C\xD8\xFD")),
-			("98", DataRecord(0x9904, b"\x98")),
-			("FF00000000000000", UnknownTypeRecord(255)),
-			("F0E31CF2C6", CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6")),
-		]
-		for (outhex, rec) in CASES:
-			outhex = outhex.replace(" ", "")
-			b: bytes = bytes.fromhex(outhex)
+		for (b, rec) in RecordTest._GET_CONTENT_CASES:
 			self.assertEqual(rec.get_content(), b)
 	
 	
@@ -219,24 +375,35 @@ class RecordTest(unittest.TestCase):
 	
 	
 	def test_to_bytes(self) -> None:
-		CASES: list[tuple[str,Record]] = [
-			("01 01 31DA 0008 00 00 0002010000000000", BeginRequestRecord(0x31DA, BeginRequestRecord.Role.AUTHORIZER, True, 0)),
-			("01 02 70AE 0000 00 00", AbortRequestRecord(0x70AE, 0)),
-			("01 03 4438 0008 00 00 1E30DB1201000000", EndRequestRecord(0x4438, 0x1E30DB12, EndRequestRecord.ProtocolStatus.CANT_MPX_CONN, 0)),
-			("01 04 A8E4 0000 00 00", ParamsRecord(0xA8E4, b"", 0)),
-			("01 05 D79C 0002 00 00 1E25", StdinRecord(0xD79C, b"\x1E\x25", 0)),
-			("01 06 5090 0003 00 00 1F9501", StdoutRecord(0x5090, b"\x1F\x95\x01", 0)),
-			("01 07 14EE 0004 00 00 F89CD8FD", StderrRecord(0x14EE, b"\xF8\x9C\xD8\xFD", 0)),
-			("01 08 9904 0001 00 00 98", DataRecord(0x9904, b"\x98", 0)),
-			("01 0B 0000 0008 00 00 FF00000000000000", UnknownTypeRecord(255, 0)),
-			("01 FE CA04 0005 03 00 F0E31CF2C6 000000", CustomRecord(254, 0xCA04, b"\xF0\xE3\x1C\xF2\xC6", 3)),
-		]
-		for (outhex, rec) in CASES:
-			outhex = outhex.replace(" ", "")
-			b: bytes = bytes.fromhex(outhex)
+		for (b, rec) in RecordTest._TO_BYTES_CASES:
 			self.assertEqual(rec.to_bytes(), b)
 
 
 
+# Runs send() on one end of a socketpair in a background thread, then shuts down
+# that end for writing; yields the other end for the test to read from.
+@contextlib.contextmanager
+def _receiving_socket(send: Callable[[socket.socket],None]) -> Iterator[socket.socket]:
+	a, b = socket.socketpair()
+	with a, b:
+		def run() -> None:
+			send(a)
+			a.shutdown(socket.SHUT_WR)
+		sender: threading.Thread = threading.Thread(target=run)
+		sender.start()
+		try:
+			yield b
+		finally:
+			b.close()  # Unblocks the sender if the test stopped reading early
+			sender.join()
+
+
+# Returns all the bytes that send() writes to a socket.
+def _transfer(send: Callable[[socket.socket],None]) -> bytes:
+	with _receiving_socket(send) as sock, sock.makefile("rb") as f:
+		return f.read()
+
+
+
 if __name__ == "__main__":
 	unittest.main()
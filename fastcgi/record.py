@@ -22,7 +22,8 @@
 # 
 
 from __future__ import annotations
-import enum, io, socket, struct
+import asyncio, enum, io, platform, socket, struct
+from typing import Callable, Protocol
 
 
 # ---- Abstract record classes ----
@@ -30,24 +31,33 @@ import enum, io, socket, struct
 class Record:  # Abstract
 	
 	_VERSION: int = 1
-	_HEADER_FORMAT: str = ">BBHHBx"
+	_HEADER_STRUCT: struct.Struct = struct.Struct(">BBHHBx")
 	
 	
 	@staticmethod
 	def read_from_socket(sock: socket.socket) -> Record|None:
-		class Adapter(io.BufferedIOBase):
-			def read(self, size: int|None = -1) -> bytes:
-				if size is None:
-					size = -1
-				segs: list[bytes] = []
-				while size != 0:
-					b: bytes = sock.recv(size if (size > 0) else 1024)
-					if len(b) == 0:
-						break
-					segs.append(b)
-					size -= len(b)
-				return b"".join(segs)
-		return Record.read_from_stream(Adapter())
+		def recv_exact(n: int) -> bytes:
+			segs: list[bytes] = []
+			while n > 0:
+				b: bytes = sock.recv(n)
+				if len(b) == 0:
+					raise EOFError()
+				segs.append(b)
+				n -= len(b)
+			return b"".join(segs)
+		
+		headerlen: int = Record._HEADER_STRUCT.size
+		header: bytes = sock.recv(headerlen)
+		if len(header) == 0:
+			return None
+		if len(header) < headerlen:
+			header += recv_exact(headerlen - len(header))
+		version, type, reqid, contentlen, padlen = _unpack_header(header)
+		if version != Record._VERSION:
+			raise ValueError("Unknown record version")
+		body: bytes = recv_exact(contentlen + padlen)
+		content: bytes = body if (padlen == 0) else body[ : contentlen]
+		return Record._dispatch(type, reqid, content, padlen)
 	
 	
 	@staticmethod
@@ -60,38 +70,77 @@ class Record:  # Abstract
 				raise EOFError()
 			return result
 		
-		temp: bytes = inp.read(struct.calcsize(Record._HEADER_FORMAT))
+		temp: bytes = inp.read(Record._HEADER_STRUCT.size)
 		if len(temp) == 0:
 			return None
-		header: bytes = temp + read_exact(struct.calcsize(Record._HEADER_FORMAT) - len(temp))
-		version, type, reqid, contentlen, padlen = struct.unpack(Record._HEADER_FORMAT, header)
+		header: bytes = temp + read_exact(Record._HEADER_STRUCT.size - len(temp))
+		version, type, reqid, contentlen, padlen = _unpack_header(header)
 		if version != Record._VERSION:
 			raise ValueError("Unknown record version")
-		content: bytes = read_exact(contentlen)
-		read_exact(padlen)
-		
-		match type:
-			case BeginRequestRecord   .TYPE:  return BeginRequestRecord   .parse_content(reqid, content, padlen)
-			case AbortRequestRecord   .TYPE:  return AbortRequestRecord   .parse_content(reqid, content, padlen)
-			case EndRequestRecord     .TYPE:  return EndRequestRecord     .parse_content(reqid, content, padlen)
-			case ParamsRecord         .TYPE:  return ParamsRecord                       (reqid, content, padlen)
-			case StdinRecord          .TYPE:  return StdinRecord                        (reqid, content, padlen)
-			case StdoutRecord         .TYPE:  return StdoutRecord                       (reqid, content, padlen)
-			case StderrRecord         .TYPE:  return StderrRecord                       (reqid, content, padlen)
-			case DataRecord           .TYPE:  return DataRecord                         (reqid, content, padlen)
-			case GetValuesRecord      .TYPE:  return GetValuesRecord      .parse_content(reqid, content, padlen)
-			case GetValuesResultRecord.TYPE:  return GetValuesResultRecord.parse_content(reqid, content, padlen)
-			case UnknownTypeRecord    .TYPE:  return UnknownTypeRecord    .parse_content(reqid, content, padlen)
-			case _                         :  return CustomRecord                 (type, reqid, content, padlen)
+		body: bytes = read_exact(contentlen + padlen)
+		content: bytes = body if (padlen == 0) else body[ : contentlen]
+		return Record._dispatch(type, reqid, content, padlen)
+	
+	
+	# Parses a buffer holding zero or more complete records back to back.
+	@staticmethod
+	def read_all_from_bytes(b: bytes) -> list[Record]:
+		result: list[Record] = []
+		headerlen: int = Record._HEADER_STRUCT.size
+		off: int = 0
+		while off < len(b):
+			if len(b) - off < headerlen:
+				raise EOFError()
+			version, type, reqid, contentlen, padlen = _unpack_header(b, off)
+			if version != Record._VERSION:
+				raise ValueError("Unknown record version")
+			start: int = off + headerlen
+			off = start + contentlen + padlen
+			if off > len(b):
+				raise EOFError()
+			result.append(Record._dispatch(type, reqid, b[start : start + contentlen], padlen))
+		return result
+	
+	
+	@staticmethod
+	async def read_from_stream_reader(reader: asyncio.StreamReader) -> Record|None:
+		try:
+			header: bytes = await reader.readexactly(Record._HEADER_STRUCT.size)
+		except asyncio.IncompleteReadError as e:
+			if len(e.partial) == 0:
+				return None
+			raise EOFError()
+		version, type, reqid, contentlen, padlen = _unpack_header(header)
+		if version != Record._VERSION:
+			raise ValueError("Unknown record version")
+		try:
+			body: bytes = await reader.readexactly(contentlen + padlen)
+		except asyncio.IncompleteReadError:
+			raise EOFError()
+		content: bytes = body if (padlen == 0) else body[ : contentlen]
+		return Record._dispatch(type, reqid, content, padlen)
+	
+	
+	@staticmethod
+	def _dispatch(type: int, reqid: int, content: bytes, padlen: int) -> Record:
+		parser: Callable[[int,bytes,int],Record]|None = _TYPE_DISPATCH.get(type)
+		if parser is None:
+			return CustomRecord(type, reqid, content, padlen)
+		return parser(reqid, content, padlen)
 	
 	
+	__slots__ = ("_request_id", "_padding_length")
 	_request_id: int
 	_padding_length: int
 	
 	
 	def __init__(self, reqid: int, padlen: int):
-		self._request_id = _check_bit_width(reqid, 16, "Request ID out of range")
-		self._padding_length = _check_bit_width(padlen, 8, "Padding length out of range")
+		if reqid >> 16 != 0:
+			raise ValueError("Request ID out of range")
+		if padlen >> 8 != 0:
+			raise ValueError("Padding length out of range")
+		self._request_id = reqid
+		self._padding_length = padlen
 	
 	
 	def get_type(self) -> int:
@@ -108,28 +157,44 @@ class Record:  # Abstract
 	
 	
 	def to_bytes(self) -> bytes:
-		type: int = _check_bit_width(self.get_type(), 8, "Type out of range")
 		content: bytes = self.get_content()
-		_check_bit_width(len(content), 16, "Content too long")
-		return struct.pack(Record._HEADER_FORMAT, Record._VERSION, type, self._request_id, len(content), self._padding_length) \
-			+ content + (b"\0" * self._padding_length)
+		return b"".join((self._pack_header(content), content, _PADDINGS[self._padding_length]))
 	
 	
 	def send_to_socket(self, sock: socket.socket) -> None:
-		sock.sendall(self.to_bytes())
+		content: bytes = self.get_content()
+		_send_buffers(sock, [self._pack_header(content), content, _PADDINGS[self._padding_length]])
+	
+	
+	async def send_to_stream_writer(self, writer: asyncio.StreamWriter) -> None:
+		content: bytes = self.get_content()
+		writer.writelines((self._pack_header(content), content, _PADDINGS[self._padding_length]))
+		await writer.drain()
+	
+	
+	def _pack_header(self, content: bytes) -> bytes:
+		type: int = self.get_type()
+		if type >> 8 != 0:
+			raise ValueError("Type out of range")
+		if len(content) >> 16 != 0:
+			raise ValueError("Content too long")
+		return Record._HEADER_STRUCT.pack(Record._VERSION, type, self._request_id, len(content), self._padding_length)
 	
 	
 	def __eq__(self, other: object) -> bool:
-		return type(self) == type(other) and self.__dict__ == other.__dict__
+		return isinstance(other, Record) and (type(self) == type(other)) \
+			and (self._request_id == other._request_id) and (self._padding_length == other._padding_length)
 
 
 
 class _SimpleRecord(Record):  # Abstract
+	__slots__ = ("_content",)
 	_content: bytes
 	
 	def __init__(self, reqid: int, content: bytes, padlen: int):
 		super().__init__(reqid, padlen)
-		_check_bit_width(len(content), 16, "Content too long")
+		if len(content) >> 16 != 0:
+			raise ValueError("Content too long")
 		self._content = content
 	
 	def get_content(self) -> bytes:
@@ -137,16 +202,22 @@ class _SimpleRecord(Record):  # Abstract
 	
 	def __repr__(self) -> str:
 		return f"{type(self).__name__}(reqid={self._request_id}, contentlen={len(self._content)}, padlen={self._padding_length})"
+	
+	def __eq__(self, other: object) -> bool:
+		return super().__eq__(other) and isinstance(other, _SimpleRecord) and (self._content == other._content)
 
 
 
 # ---- Concrete record classes ----
 
 class CustomRecord(_SimpleRecord):
+	__slots__ = ("_type",)
 	_type: int
 	
 	def __init__(self, type: int, reqid: int, content: bytes, padlen: int = 0):
-		self._type = _check_bit_width(type, 8, "Type out of range")
+		if type >> 8 != 0:
+			raise ValueError("Type out of range")
+		self._type = type
 		super().__init__(reqid, content, padlen)
 	
 	def get_type(self) -> int:
@@ -154,34 +225,32 @@ class CustomRecord(_SimpleRecord):
 	
 	def __repr__(self) -> str:
 		return f"CustomRecord(type={self._type}, reqid={self._request_id}, contentlen={len(self._content)}, padlen={self._padding_length})"
+	
+	def __eq__(self, other: object) -> bool:
+		return super().__eq__(other) and isinstance(other, CustomRecord) and (self._type == other._type)
 
 
 
 class BeginRequestRecord(Record):
 	
 	TYPE: int = 1
-	_FORMAT: str = ">HB5x"
+	_STRUCT: struct.Struct = struct.Struct(">HB5x")
 	_FLAG_KEEP_CONN: int = 1 << 0
 	
 	
 	@staticmethod
 	def parse_content(reqid: int, content: bytes, padlen: int) -> BeginRequestRecord:
-		roleint, flagsint = struct.unpack(BeginRequestRecord._FORMAT, content)
-		for member0 in BeginRequestRecord.Role:
-			if member0.value == roleint:
-				role: BeginRequestRecord.Role = member0
-				break
-		else:
-			raise ValueError(f"Unrecognized role: {roleint}")
-		keepconn: bool = flagsint & BeginRequestRecord._FLAG_KEEP_CONN != 0
-		flagsint &= ~BeginRequestRecord._FLAG_KEEP_CONN
-		if flagsint != 0:
-			raise ValueError("Unrecognized flag")
-		return BeginRequestRecord(reqid, role, keepconn, padlen)
+		if reqid >> 16 != 0:
+			raise ValueError("Request ID out of range")
+		if padlen >> 8 != 0:
+			raise ValueError("Padding length out of range")
+		return _parse_begin_request(reqid, content, padlen)
 	
 	
+	__slots__ = ("_role", "_keep_conn", "_content")
 	_role: BeginRequestRecord.Role
 	_keep_conn: bool
+	_content: bytes
 	
 	
 	def __init__(self, reqid: int, role: BeginRequestRecord.Role, keepconn: bool, padlen: int = 0):
@@ -190,6 +259,7 @@ class BeginRequestRecord(Record):
 		super().__init__(reqid, padlen)
 		self._role = role
 		self._keep_conn = keepconn
+		self._content = BeginRequestRecord._STRUCT.pack(role.value, (BeginRequestRecord._FLAG_KEEP_CONN if keepconn else 0))
 	
 	
 	def get_role(self) -> BeginRequestRecord.Role:
@@ -202,28 +272,36 @@ class BeginRequestRecord(Record):
 		return BeginRequestRecord.TYPE
 	
 	def get_content(self) -> bytes:
-		return struct.pack(BeginRequestRecord._FORMAT, self._role.value, (BeginRequestRecord._FLAG_KEEP_CONN if self._keep_conn else 0))
+		return self._content
 	
 	def __repr__(self) -> str:
 		return f"BeginRequestRecord(reqid={self._request_id}, role={self._role}, keepconn={self._keep_conn}, padlen={self._padding_length})"
 	
+	def __eq__(self, other: object) -> bool:
+		return super().__eq__(other) and isinstance(other, BeginRequestRecord) \
+			and (self._role == other._role) and (self._keep_conn == other._keep_conn)
+	
 	
 	class Role(enum.Enum):
 		RESPONDER: int = 1
 		AUTHORIZER: int = 2
 		FILTER: int = 3
+	
+	_ROLES_BY_VALUE: dict[int,Role] = {member.value: member for member in Role}
 
 
 
 class AbortRequestRecord(Record):
 	
 	TYPE: int = 2
-	_FORMAT: str = ">"
+	_STRUCT: struct.Struct = struct.Struct(">")
+	_CONTENT: bytes = _STRUCT.pack()
+	__slots__ = ()
 	
 	
 	@staticmethod
 	def parse_content(reqid: int, content: bytes, padlen: int) -> AbortRequestRecord:
-		struct.unpack(AbortRequestRecord._FORMAT, content)
+		AbortRequestRecord._STRUCT.unpack(content)
 		return AbortRequestRecord(reqid, padlen)
 	
 	
@@ -237,7 +315,7 @@ class AbortRequestRecord(Record):
 		return AbortRequestRecord.TYPE
 	
 	def get_content(self) -> bytes:
-		return struct.pack(AbortRequestRecord._FORMAT)
+		return AbortRequestRecord._CONTENT
 	
 	def __repr__(self) -> str:
 		return f"AbortRequestRecord(reqid={self._request_id}, padlen={self._padding_length})"
@@ -247,31 +325,33 @@ class AbortRequestRecord(Record):
 class EndRequestRecord(Record):
 	
 	TYPE: int = 3
-	_FORMAT: str = ">IB3x"
+	_STRUCT: struct.Struct = struct.Struct(">IB3x")
 	
 	
 	@staticmethod
 	def parse_content(reqid: int, content: bytes, padlen: int) -> EndRequestRecord:
-		appstat, protostatint = struct.unpack(EndRequestRecord._FORMAT, content)
-		for member in EndRequestRecord.ProtocolStatus:
-			if member.value == protostatint:
-				protostat: EndRequestRecord.ProtocolStatus = member
-				break
-		else:
-			raise ValueError(f"Unrecognized protocol status: {protostatint}")
-		return EndRequestRecord(reqid, appstat, protostat, padlen)
+		if reqid >> 16 != 0:
+			raise ValueError("Request ID out of range")
+		if padlen >> 8 != 0:
+			raise ValueError("Padding length out of range")
+		return _parse_end_request(reqid, content, padlen)
 	
 	
+	__slots__ = ("_application_status", "_protocol_status", "_content")
 	_application_status: int
 	_protocol_status: EndRequestRecord.ProtocolStatus
+	_content: bytes
 	
 	
 	def __init__(self, reqid: int, appstat: int, protostat: ProtocolStatus, padlen: int = 0):
 		if reqid == 0:
 			raise ValueError("Invalid request ID")
 		super().__init__(reqid, padlen)
-		self._application_status = _check_bit_width(appstat, 32, "Application status out of range")
+		if appstat >> 32 != 0:
+			raise ValueError("Application status out of range")
+		self._application_status = appstat
 		self._protocol_status = protostat
+		self._content = EndRequestRecord._STRUCT.pack(self._application_status, protostat.value)
 	
 	
 	def get_application_status(self) -> int:
@@ -284,22 +364,29 @@ class EndRequestRecord(Record):
 		return EndRequestRecord.TYPE
 	
 	def get_content(self) -> bytes:
-		return struct.pack(EndRequestRecord._FORMAT, self._application_status, self._protocol_status.value)
+		return self._content
 	
 	def __repr__(self) -> str:
 		return f"EndRequestRecord(reqid={self._request_id}, appstatus={self._application_status}, protocolstatus={self._protocol_status}, padlen={self._padding_length})"
 	
+	def __eq__(self, other: object) -> bool:
+		return super().__eq__(other) and isinstance(other, EndRequestRecord) \
+			and (self._application_status == other._application_status) and (self._protocol_status == other._protocol_status)
+	
 	
 	class ProtocolStatus(enum.Enum):
 		REQUEST_COMPLETE: int = 0
 		CANT_MPX_CONN: int = 1
 		OVERLOADED: int = 2
 		UNKNOWN_ROLE: int = 3
+	
+	_PROTOCOL_STATUSES_BY_VALUE: dict[int,ProtocolStatus] = {member.value: member for member in ProtocolStatus}
 
 
 
 class ParamsRecord(_SimpleRecord):
 	TYPE: int = 4
+	__slots__ = ()
 	
 	def __init__(self, reqid: int, content: bytes, padlen: int = 0):
 		if reqid == 0:
@@ -313,6 +400,7 @@ class ParamsRecord(_SimpleRecord):
 
 class StdinRecord(_SimpleRecord):
 	TYPE: int = 5
+	__slots__ = ()
 	
 	def __init__(self, reqid: int, content: bytes, padlen: int = 0):
 		if reqid == 0:
@@ -326,6 +414,7 @@ class StdinRecord(_SimpleRecord):
 
 class StdoutRecord(_SimpleRecord):
 	TYPE: int = 6
+	__slots__ = ()
 	
 	def __init__(self, reqid: int, content: bytes, padlen: int = 0):
 		if reqid == 0:
@@ -339,6 +428,7 @@ class StdoutRecord(_SimpleRecord):
 
 class StderrRecord(_SimpleRecord):
 	TYPE: int = 7
+	__slots__ = ()
 	
 	def __init__(self, reqid: int, content: bytes, padlen: int = 0):
 		if reqid == 0:
@@ -352,6 +442,7 @@ class StderrRecord(_SimpleRecord):
 
 class DataRecord(_SimpleRecord):
 	TYPE: int = 8
+	__slots__ = ()
 	
 	def __init__(self, reqid: int, content: bytes, padlen: int = 0):
 		if reqid == 0:
@@ -373,11 +464,21 @@ class GetValuesRecord(Record):
 		if reqid != 0:
 			raise ValueError("Invalid request ID")
 		pairs: dict[str,str] = name_values_to_dict(content)
-		if any(v != "" for v in pairs.values()):
+		if any(pairs.values()):  # All values are str, so only "" is falsy
 			raise ValueError("Non-empty value")
-		return GetValuesRecord(set(pairs.keys()), padlen)
+		return GetValuesRecord._from_parsed(set(pairs.keys()), padlen)
 	
 	
+	# Takes ownership of the given set instead of copying it.
+	@staticmethod
+	def _from_parsed(names: set[str], padlen: int) -> GetValuesRecord:
+		result: GetValuesRecord = GetValuesRecord.__new__(GetValuesRecord)
+		Record.__init__(result, 0, padlen)
+		result._names = names
+		return result
+	
+	
+	__slots__ = ("_names",)
 	_names: set[str]
 	
 	
@@ -393,10 +494,13 @@ class GetValuesRecord(Record):
 		return GetValuesRecord.TYPE
 	
 	def get_content(self) -> bytes:
-		return dict_to_name_values({k: "" for k in self._names})
+		return dict_to_name_values(dict.fromkeys(self._names, ""))
 	
 	def __repr__(self) -> str:
 		return f"GetValuesRecord(reqid={self._request_id}, names={self._names}, padlen={self._padding_length})"
+	
+	def __eq__(self, other: object) -> bool:
+		return super().__eq__(other) and isinstance(other, GetValuesRecord) and (self._names == other._names)
 
 
 
@@ -409,9 +513,19 @@ class GetValuesResultRecord(Record):
 	def parse_content(reqid: int, content: bytes, padlen: int) -> GetValuesResultRecord:
 		if reqid != 0:
 			raise ValueError("Invalid request ID")
-		return GetValuesResultRecord(name_values_to_dict(content), padlen)
+		return GetValuesResultRecord._from_parsed(name_values_to_dict(content), padlen)
+	
+	
+	# Takes ownership of the given dict instead of copying it.
+	@staticmethod
+	def _from_parsed(pairs: dict[str,str], padlen: int) -> GetValuesResultRecord:
+		result: GetValuesResultRecord = GetValuesResultRecord.__new__(GetValuesResultRecord)
+		Record.__init__(result, 0, padlen)
+		result._pairs = pairs
+		return result
 	
 	
+	__slots__ = ("_pairs",)
 	_pairs: dict[str,str]
 	
 	
@@ -431,29 +545,37 @@ class GetValuesResultRecord(Record):
 	
 	def __repr__(self) -> str:
 		return f"GetValuesResultRecord(reqid={self._request_id}, pairs={self._pairs}, padlen={self._padding_length})"
+	
+	def __eq__(self, other: object) -> bool:
+		return super().__eq__(other) and isinstance(other, GetValuesResultRecord) and (self._pairs == other._pairs)
 
 
 
 class UnknownTypeRecord(Record):
 	
 	TYPE: int = 11
-	_FORMAT: str = ">B7x"
+	_STRUCT: struct.Struct = struct.Struct(">B7x")
 	
 	
 	@staticmethod
 	def parse_content(reqid: int, content: bytes, padlen: int) -> UnknownTypeRecord:
 		if reqid != 0:
 			raise ValueError("Invalid request ID")
-		unknowntype, = struct.unpack(UnknownTypeRecord._FORMAT, content)
+		unknowntype, = UnknownTypeRecord._STRUCT.unpack(content)
 		return UnknownTypeRecord(unknowntype, padlen)
 	
 	
+	__slots__ = ("_unknown_type", "_content")
 	_unknown_type: int
+	_content: bytes
 	
 	
 	def __init__(self, unknowntype: int, padlen: int = 0):
 		super().__init__(0, padlen)
-		self._unknown_type = _check_bit_width(unknowntype, 8, "Type out of range")
+		if unknowntype >> 8 != 0:
+			raise ValueError("Type out of range")
+		self._unknown_type = unknowntype
+		self._content = UnknownTypeRecord._STRUCT.pack(unknowntype)
 	
 	
 	def get_unknown_type(self) -> int:
@@ -463,55 +585,294 @@ class UnknownTypeRecord(Record):
 		return UnknownTypeRecord.TYPE
 	
 	def get_content(self) -> bytes:
-		return struct.pack(UnknownTypeRecord._FORMAT, self._unknown_type)
+		return self._content
 	
 	def __repr__(self) -> str:
 		return f"UnknownTypeRecord(reqid={self._request_id}, unknowntype={self._unknown_type}, padlen={self._padding_length})"
+	
+	def __eq__(self, other: object) -> bool:
+		return super().__eq__(other) and isinstance(other, UnknownTypeRecord) and (self._unknown_type == other._unknown_type)
+
+
+
+# Specialized parsers for records read off the wire, where the header format already
+# guarantees that the request ID and padding length are in range. Lookups are bound
+# as default arguments so that they resolve as fast locals. The content is repacked
+# rather than kept, because unpacking ignores the values of reserved bytes.
+
+def _parse_begin_request(reqid: int, content: bytes, padlen: int,
+		_unpack: Callable[[bytes],tuple[int,int]] = BeginRequestRecord._STRUCT.unpack,
+		_pack: Callable[[int,int],bytes] = BeginRequestRecord._STRUCT.pack,
+		_roles: dict[int,BeginRequestRecord.Role] = BeginRequestRecord._ROLES_BY_VALUE,
+		_cls: type[BeginRequestRecord] = BeginRequestRecord,
+		) -> BeginRequestRecord:
+	if reqid == 0:
+		raise ValueError("Invalid request ID")
+	roleint, flagsint = _unpack(content)
+	role: BeginRequestRecord.Role|None = _roles.get(roleint)
+	if role is None:
+		raise ValueError(f"Unrecognized role: {roleint}")
+	if flagsint & ~_cls._FLAG_KEEP_CONN != 0:
+		raise ValueError("Unrecognized flag")
+	result: BeginRequestRecord = _cls.__new__(_cls)
+	result._request_id = reqid
+	result._padding_length = padlen
+	result._role = role
+	result._keep_conn = flagsint != 0
+	result._content = _pack(roleint, flagsint)
+	return result
+
+
+def _parse_end_request(reqid: int, content: bytes, padlen: int,
+		_unpack: Callable[[bytes],tuple[int,int]] = EndRequestRecord._STRUCT.unpack,
+		_pack: Callable[[int,int],bytes] = EndRequestRecord._STRUCT.pack,
+		_statuses: dict[int,EndRequestRecord.ProtocolStatus] = EndRequestRecord._PROTOCOL_STATUSES_BY_VALUE,
+		_cls: type[EndRequestRecord] = EndRequestRecord,
+		) -> EndRequestRecord:
+	if reqid == 0:
+		raise ValueError("Invalid request ID")
+	appstat, protostatint = _unpack(content)
+	protostat: EndRequestRecord.ProtocolStatus|None = _statuses.get(protostatint)
+	if protostat is None:
+		raise ValueError(f"Unrecognized protocol status: {protostatint}")
+	result: EndRequestRecord = _cls.__new__(_cls)
+	result._request_id = reqid
+	result._padding_length = padlen
+	result._application_status = appstat
+	result._protocol_status = protostat
+	result._content = _pack(appstat, protostatint)
+	return result
+
+
+def _make_simple_parser(cls: type[_SimpleRecord]) -> Callable[[int,bytes,int],_SimpleRecord]:
+	def parse(reqid: int, content: bytes, padlen: int) -> _SimpleRecord:
+		if reqid == 0:
+			raise ValueError("Invalid request ID")
+		result: _SimpleRecord = cls.__new__(cls)
+		result._request_id = reqid
+		result._padding_length = padlen
+		result._content = content
+		return result
+	return parse
+
+
+_TYPE_DISPATCH: dict[int,Callable[[int,bytes,int],Record]] = {
+	BeginRequestRecord   .TYPE: _parse_begin_request               ,
+	AbortRequestRecord   .TYPE: AbortRequestRecord   .parse_content,
+	EndRequestRecord     .TYPE: _parse_end_request                 ,
+	ParamsRecord         .TYPE: _make_simple_parser(ParamsRecord)  ,
+	StdinRecord          .TYPE: _make_simple_parser(StdinRecord)   ,
+	StdoutRecord         .TYPE: _make_simple_parser(StdoutRecord)  ,
+	StderrRecord         .TYPE: _make_simple_parser(StderrRecord)  ,
+	DataRecord           .TYPE: _make_simple_parser(DataRecord)    ,
+	GetValuesRecord      .TYPE: GetValuesRecord      .parse_content,
+	GetValuesResultRecord.TYPE: GetValuesResultRecord.parse_content,
+	UnknownTypeRecord    .TYPE: UnknownTypeRecord    .parse_content,
+}
+
+
+
+# ---- Record streams ----
+
+class RecordStream:
+	
+	_socket: socket.socket
+	_buffer: bytearray
+	_view: memoryview
+	_start: int  # Index of the first unconsumed byte
+	_end: int  # Index after the last received byte
+	
+	
+	def __init__(self, sock: socket.socket, bufsize: int = 2**17):
+		if bufsize < RecordStream._MAX_RECORD_LENGTH:
+			raise ValueError("Buffer size too small")
+		self._socket = sock
+		self._buffer = bytearray(bufsize)
+		self._view = memoryview(self._buffer)
+		self._start = 0
+		self._end = 0
+	
+	
+	def read(self) -> Record|None:
+		headerlen: int = Record._HEADER_STRUCT.size
+		if not self._fill(headerlen):
+			if self._end > self._start:
+				raise EOFError()
+			return None
+		version, type, reqid, contentlen, padlen = _unpack_header(self._buffer, self._start)
+		if version != Record._VERSION:
+			raise ValueError("Unknown record version")
+		if not self._fill(headerlen + contentlen + padlen):
+			raise EOFError()
+		off: int = self._start + headerlen
+		content: bytes = bytes(self._view[off : off + contentlen])
+		self._start = off + contentlen + padlen
+		return Record._dispatch(type, reqid, content, padlen)
+	
+	
+	# Ensures that at least n unconsumed bytes are buffered, returning False if the socket reaches EOF first.
+	def _fill(self, n: int) -> bool:
+		if self._start == self._end:
+			self._start = 0
+			self._end = 0
+		elif self._start + n > len(self._buffer):
+			avail: int = self._end - self._start
+			self._buffer[ : avail] = self._buffer[self._start : self._end]
+			self._start = 0
+			self._end = avail
+		while self._end - self._start < n:
+			k: int = self._socket.recv_into(self._view[self._end : ])
+			if k == 0:
+				return False
+			self._end += k
+		return True
+	
+	
+	_MAX_RECORD_LENGTH: int = 8 + (2**16 - 1) + (2**8 - 1)
+
+
+
+# Anything that records can be sent to, such as a socket. If the object also has
+# a socket-style sendmsg() method, it is used for vectored sends.
+class SupportsSendall(Protocol):
+	def sendall(self, data: bytes, /) -> None: ...
+
+
+
+# Accumulates serialized records and sends them to the socket in large batches.
+# Callers must call flush() after writing the last record of a response.
+class BufferedRecordWriter:
+	
+	_socket: SupportsSendall
+	_buffer: bytearray
+	_capacity: int
+	
+	
+	def __init__(self, sock: SupportsSendall, capacity: int = 2**16):
+		self._socket = sock
+		self._buffer = bytearray()
+		self._capacity = capacity
+	
+	
+	def write(self, rec: Record) -> None:
+		content: bytes = rec.get_content()
+		header: bytes = rec._pack_header(content)
+		padding: bytes = _PADDINGS[rec._padding_length]
+		buf: bytearray = self._buffer
+		if len(buf) + len(content) < self._capacity:
+			buf += header
+			buf += content
+			buf += padding
+		else:  # Send everything in one call without copying the large content
+			_send_buffers(self._socket, [buf, header, content, padding])
+			buf.clear()
+	
+	
+	# Writes already-serialized records.
+	def write_bytes(self, b: bytes) -> None:
+		self._buffer += b
+		if len(self._buffer) >= self._capacity:
+			self.flush()
+	
+	
+	def flush(self) -> None:
+		if len(self._buffer) > 0:
+			self._socket.sendall(self._buffer)
+			self._buffer.clear()
 
 
 
 # ---- Name-value pairs ----
 
+_U32_STRUCT: struct.Struct = struct.Struct(">I")
+
+
 def name_values_to_dict(b: bytes) -> dict[str,str]:
 	result: dict[str,str] = {}
+	text: str = b.decode("ISO-8859-1")  # Character indexes equal byte indexes
+	unpack_from: Callable[[bytes,int],tuple[int]] = _U32_STRUCT.unpack_from
+	end: int = len(b)
 	i: int = 0
-	while i < len(b):
-		lens: list[int] = []
-		for _ in range(2):
-			n: int = b[i]
-			if n < 128:
-				i += 1
-			else:
-				n = struct.unpack(">I", b[i : i + 4])[0] ^ (1 << 31)
-				i += 4
-			lens.append(n)
-		keyb: bytes = b[i : i + lens[0]]
-		i += lens[0]
-		valb: bytes = b[i : i + lens[1]]
-		i += lens[1]
-		if i > len(b):
+	while i < end:
+		keylen: int = b[i]
+		if keylen < 128:
+			i += 1
+		else:
+			keylen = unpack_from(b, i)[0] ^ (1 << 31)
+			i += 4
+		vallen: int = b[i]
+		if vallen < 128:
+			i += 1
+		else:
+			vallen = unpack_from(b, i)[0] ^ (1 << 31)
+			i += 4
+		key: str = text[i : i + keylen]
+		i += keylen
+		val: str = text[i : i + vallen]
+		i += vallen
+		if i > end:
 			raise EOFError()
-		result[keyb.decode("ISO-8859-1")] = valb.decode("ISO-8859-1")
+		result[key] = val
 	return result
 
 
 def dict_to_name_values(d: dict[str,str]) -> bytes:
-	segs: list[bytes] = []
+	result: bytearray = bytearray()
+	pack: Callable[[int],bytes] = _U32_STRUCT.pack
 	for (key, val) in d.items():
 		keyb: bytes = key.encode("ISO-8859-1")
 		valb: bytes = val.encode("ISO-8859-1")
-		for n in (len(keyb), len(valb)):
-			segs.append(struct.pack(">B", n) if (n < 128)
-				else struct.pack(">I", n | (1 << 31)))
-		segs.append(keyb)
-		segs.append(valb)
-	return b"".join(segs)
+		n: int = len(keyb)
+		if n < 128:
+			result.append(n)
+		else:
+			result += pack(n | (1 << 31))
+		n = len(valb)
+		if n < 128:
+			result.append(n)
+		else:
+			result += pack(n | (1 << 31))
+		result += keyb
+		result += valb
+	return bytes(result)
 
 
 
 # ---- Utilities ----
 
-def _check_bit_width(val: int, width: int, errmsg: str) -> int:
-	if val >> width != 0:
-		raise ValueError(errmsg)
-	return val
+# Returns (version, type, request ID, content length, padding length) from the record header at the given offset.
+# PyPy's JIT traces direct byte indexing much better than calls into the struct module.
+if platform.python_implementation() == "PyPy":
+	def _unpack_header(b: bytes|bytearray, off: int = 0) -> tuple[int,...]:
+		return (b[off], b[off + 1], (b[off + 2] << 8) | b[off + 3], (b[off + 4] << 8) | b[off + 5], b[off + 6])
+else:
+	_unpack_header = Record._HEADER_STRUCT.unpack_from
+
+
+# Zero-filled padding of every possible length, so that serializing a record never allocates padding
+_PADDINGS: tuple[bytes,...] = tuple(bytes(n) for n in range(2**8))
+
+
+# Sends all the given buffers in order, using vectored I/O where the platform supports it.
+def _send_buffers(sock: SupportsSendall, bufs: list[bytes]) -> None:
+	sendmsg: Callable[[list[memoryview]],int]|None = getattr(sock, "sendmsg", None)
+	if sendmsg is None:
+		sock.sendall(b"".join(bufs))
+		return
+	views: list[memoryview] = [memoryview(b) for b in bufs if len(b) > 0]
+	created: list[memoryview] = list(views)
+	try:
+		i: int = 0
+		while i < len(views):
+			n: int = sendmsg(views[i : ])
+			while (i < len(views)) and (n >= len(views[i])):
+				n -= len(views[i])
+				i += 1
+			if n > 0:
+				views[i] = views[i][n : ]
+				created.append(views[i])
+	finally:
+		# Release explicitly so that callers can resize a bytearray right afterward,
+		# even on implementations that free objects lazily
+		for view in reversed(created):
+			view.release()
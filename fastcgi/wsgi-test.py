@@ -0,0 +1,195 @@
+# 
+# FastCGI library
+# 
+# Copyright (c) Project Nayuki. (MIT License)
+# https://www.nayuki.io/page/fastcgi-library
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+# - The above copyright notice and this permission notice shall be included in
+#   all copies or substantial portions of the Software.
+# - The Software is provided "as is", without warranty of any kind, express or
+#   implied, including but not limited to the warranties of merchantability,
+#   fitness for a particular purpose and noninfringement. In no event shall the
+#   authors or copyright holders be liable for any claim, damages or other
+#   liability, whether in an action of contract, tort or otherwise, arising from,
+#   out of or in connection with the Software or the use or other dealings in the
+#   Software.
+# 
+
+
+from __future__ import annotations
+import asyncio, concurrent.futures, os, pathlib, random, socket, sys, tempfile, threading, time, unittest
+from typing import Awaitable, Callable, Iterable, Iterator
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastcgi import record, wsgi
+
+
+class AsyncServerTest(unittest.TestCase):
+	
+	def test_requests(self) -> None:
+		BODY: bytes = random.randbytes(200000)  # Needs several Stdout records
+		def app(environ: dict[str,object], startresp: Callable[[str,list[tuple[str,str]]],Callable[[bytes],None]]) -> Iterable[bytes]:
+			startresp("200 OK", [("Content-Type", "application/octet-stream")])
+			if environ["PATH_INFO"] == "/big":
+				return [BODY[ : 100000], BODY[100000 : ]]
+			return [b"echo:", environ["wsgi.input"].read()]  # type: ignore
+		
+		async def client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+			self.assertEqual(await _request(self, reader, writer, 1, {"PATH_INFO": "/echo"}, b"hello", True),
+				b"HTTP/1.0 200 OK\r\nContent-Type: application/octet-stream\r\n\r\necho:hello")
+			self.assertEqual(await _request(self, reader, writer, 2, {"PATH_INFO": "/big"}, b"", False),
+				b"HTTP/1.0 200 OK\r\nContent-Type: application/octet-stream\r\n\r\n" + BODY)
+			self.assertIsNone(await record.Record.read_from_stream_reader(reader))
+		_run_server(app, client)
+	
+	
+	def test_independent_environ(self) -> None:
+		environs: list[dict[str,object]] = []
+		seen: list[tuple[object,bool]] = []
+		def app(environ: dict[str,object], startresp: Callable[[str,list[tuple[str,str]]],Callable[[bytes],None]]) -> Iterable[bytes]:
+			environs.append(environ)
+			seen.append((environ["PATH_INFO"], "HTTP_X_ADDED" in environ))
+			environ["PATH_INFO"] = "/changed"
+			environ["HTTP_X_ADDED"] = "1"
+			startresp("204 No Content", [])
+			return []
+		
+		async def client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+			# Only the first parameters go through the parse cache; the others bypass it
+			for params in (
+					{"PATH_INFO": "/same"},
+					{"PATH_INFO": "/same", "HTTP_COOKIE": "session=abc"},
+					{"PATH_INFO": "/same", "HTTP_AUTHORIZATION": "Bearer abc"},
+					{"PATH_INFO": "/same", "HTTP_X_LARGE": "x" * 5000}):
+				environs.clear()
+				seen.clear()
+				for reqid in (1, 2):
+					await _request(self, reader, writer, reqid, params, b"", True)
+				self.assertIsNot(environs[0], environs[1])
+				self.assertEqual(seen, [("/same", False), ("/same", False)])
+		
+		wsgi._Request._parse_params_cached.cache_clear()
+		_run_server(app, client)
+		self.assertEqual(wsgi._Request._parse_params_cached.cache_info().currsize, 1)
+
+
+
+class ServerTest(unittest.TestCase):
+	
+	def test_requests(self) -> None:
+		BODY: bytes = random.randbytes(100000)  # Needs several Stdout records
+		def app(environ: dict[str,object], startresp: Callable[[str,list[tuple[str,str]]],Callable[[bytes],None]]) -> Iterator[bytes]:
+			startresp("200 OK", [("Content-Type", "text/plain")])
+			yield b"path:"
+			yield str(environ["PATH_INFO"]).encode("ASCII")
+			yield b""
+			buf: bytearray = bytearray(environ["wsgi.input"].read())  # type: ignore
+			yield buf
+			buf.clear()  # The server must not hold on to a block after sending it
+		
+		def client(sock: socket.socket) -> None:
+			HEAD: bytes = b"HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n\r\n"
+			self.assertEqual(_request_sync(self, sock, 1, {"PATH_INFO": "/a"}, b"hello", True), HEAD + b"path:/ahello")
+			self.assertEqual(_request_sync(self, sock, 1, {"PATH_INFO": "/b"}, BODY, False), HEAD + b"path:/b" + BODY)
+			self.assertIsNone(record.Record.read_from_socket(sock))  # Closed by the server
+		_run_threaded_server(app, client)
+
+
+
+# Runs a Server for the application in a daemon thread on a temporary Unix socket,
+# and runs the client against one connection to it. The server thread is left running.
+def _run_threaded_server(app: Callable, client: Callable[[socket.socket],None]) -> None:
+	with tempfile.TemporaryDirectory() as tempdir, \
+			concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+		path: str = os.path.join(tempdir, "fcgi.sock")
+		server: wsgi.Server = wsgi.Server(app, path, executor=executor)
+		threading.Thread(target=server.run, daemon=True).start()
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+			sock.connect(path)
+			client(sock)
+
+
+# Serves the application on a temporary Unix socket and runs the client against one connection to it.
+def _run_server(app: Callable, client: Callable[[asyncio.StreamReader,asyncio.StreamWriter],Awaitable[None]]) -> None:
+	async def run(path: str) -> None:
+		server: asyncio.Task[None] = asyncio.create_task(wsgi.AsyncServer(app, path).serve())
+		try:
+			while not pathlib.Path(path).exists():
+				await asyncio.sleep(0.01)
+			reader, writer = await asyncio.open_unix_connection(path)
+			try:
+				await client(reader, writer)
+			finally:
+				writer.close()
+				await writer.wait_closed()
+			# Let the server's connection handler see the close, instead of cancelling it midway
+			while len(asyncio.all_tasks()) > 2:
+				await asyncio.sleep(0.01)
+		finally:
+			server.cancel()
+			try:
+				await server
+			except asyncio.CancelledError:
+				pass
+	
+	with tempfile.TemporaryDirectory() as tempdir:
+		asyncio.run(run(os.path.join(tempdir, "fcgi.sock")))
+
+
+# Sends one request and returns the concatenated Stdout content of the response.
+async def _request(test: unittest.TestCase, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+		reqid: int, params: dict[str,str], body: bytes, keepconn: bool) -> bytes:
+	for rec in _request_records(reqid, params, body, keepconn):
+		await rec.send_to_stream_writer(writer)
+	segs: list[bytes] = []
+	while _collect_response(test, reqid, await record.Record.read_from_stream_reader(reader), segs):
+		pass
+	test.assertEqual(segs[-1], b"")  # The Stdout stream was terminated
+	return b"".join(segs)
+
+
+# Sends one request over a blocking socket and returns the concatenated Stdout content of the response.
+def _request_sync(test: unittest.TestCase, sock: socket.socket, reqid: int, params: dict[str,str], body: bytes, keepconn: bool) -> bytes:
+	for rec in _request_records(reqid, params, body, keepconn):
+		rec.send_to_socket(sock)
+	segs: list[bytes] = []
+	while _collect_response(test, reqid, record.Record.read_from_socket(sock), segs):
+		pass
+	test.assertEqual(segs[-1], b"")  # The Stdout stream was terminated
+	return b"".join(segs)
+
+
+# Returns the records that a web server sends for one request.
+def _request_records(reqid: int, params: dict[str,str], body: bytes, keepconn: bool) -> list[record.Record]:
+	result: list[record.Record] = [
+		record.BeginRequestRecord(reqid, record.BeginRequestRecord.Role.RESPONDER, keepconn),
+		record.ParamsRecord(reqid, record.dict_to_name_values({"REQUEST_SCHEME": "http", **params})),
+		record.ParamsRecord(reqid, b""),
+	]
+	for i in range(0, len(body), 2**16 - 1):
+		result.append(record.StdinRecord(reqid, body[i : i + 2**16 - 1]))
+	result.append(record.StdinRecord(reqid, b""))
+	return result
+
+
+# Appends the content of the given response record to segs, returning whether more records follow.
+def _collect_response(test: unittest.TestCase, reqid: int, rc: record.Record|None, segs: list[bytes]) -> bool:
+	if rc is None:
+		test.fail("Connection closed before the request ended")
+	test.assertEqual(rc.get_request_id(), reqid)
+	if isinstance(rc, record.EndRequestRecord):
+		test.assertEqual(rc.get_protocol_status(), record.EndRequestRecord.ProtocolStatus.REQUEST_COMPLETE)
+		return False
+	test.assertIsInstance(rc, record.StdoutRecord)
+	segs.append(rc.get_content())
+	return True
+
+
+
+if __name__ == "__main__":
+	unittest.main()
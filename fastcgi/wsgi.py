@@ -22,7 +22,7 @@
 # 
 
 from __future__ import annotations
-import collections, io, os, pathlib, socket, threading, time
+import asyncio, concurrent.futures, functools, io, os, pathlib, socket, traceback
 from typing import Callable, Iterable
 from . import record
 
@@ -36,7 +36,7 @@ class Server:
 	
 	_application: _ApplicationType
 	_server_socket: socket.socket
-	_executor: ThreadPoolExecutor
+	_executor: concurrent.futures.Executor
 	
 	
 	def __init__(self,
@@ -45,7 +45,7 @@ class Server:
 			*,
 			umask: int|None = None,
 			listen_backlog: int = 1000,
-			executor: ThreadPoolExecutor|None = None):
+			executor: concurrent.futures.Executor|None = None):
 		
 		self._application = app
 		
@@ -62,48 +62,35 @@ class Server:
 				os.umask(oldmask)
 		
 		self._server_socket.listen(listen_backlog)
-		self._executor = ThreadPoolExecutor() if (executor is None) else executor
+		self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=100) if (executor is None) else executor
 	
 	
 	def run(self) -> None:
 		with self._server_socket:
 			while True:
 				sock, _ = self._server_socket.accept()
-				self._executor.submit(self._make_task(sock))
+				self._executor.submit(self._make_task(sock)).add_done_callback(_report_exception)
 	
 	
 	def _make_task(self, sock: socket.socket) -> Callable[[],None]:
 		def run() -> None:
 			with sock:
 				try:
+					stream: record.RecordStream = record.RecordStream(sock)
 					req: _Request|None = None
 					while True:
-						rc: record.Record|None = record.Record.read_from_socket(sock)
+						rc: record.Record|None = stream.read()
 						if rc is None:
 							if req is not None:
 								raise EOFError()
 							break
-						elif rc.get_request_id() == 0:
-							raise ValueError("Unknown management record type")
-						elif isinstance(rc, record.BeginRequestRecord):
-							if req is not None:
-								raise ValueError("Concurrent request")
-							req = _Request(self._application, sock, rc)
-						elif (req is None) or (rc.get_request_id() != req.get_id()):
-							raise ValueError("Missing request")
-						elif isinstance(rc, record.ParamsRecord):
-							req._params.write(rc.get_content())
-						elif isinstance(rc, record.StdinRecord):
-							b: bytes = rc.get_content()
-							req._stdin.write(b)
-							if len(b) == 0:
-								req._process()
-								keepconn: bool = req._keep_conn
-								req = None
-								if not keepconn:
-									break
-						else:
-							raise ValueError("Unknown request record type")
+						req, ready = _Request._handle_record(self._application, sock, req, rc)
+						if ready:
+							req._process()
+							keepconn: bool = req._keep_conn
+							req = None
+							if not keepconn:
+								break
 				except BrokenPipeError:
 					pass
 		
@@ -111,107 +98,139 @@ class Server:
 
 
 
-class ThreadPoolExecutor:
+# Serves all connections from a single asyncio event loop, so that idle keep-alive
+# connections do not each occupy a thread. The synchronous WSGI application is
+# run on the given executor (or the event loop's default one) for each request.
+class AsyncServer:
 	
-	_min_workers: int
-	_max_workers: int
-	_lock: threading.Lock
-	_queue_nonempty: threading.Condition
-	_queue: collections.deque[Callable[[],None]|None]
-	_num_workers: int
-	_num_idle_workers: int
-	_cleanable: threading.Condition
+	_application: _ApplicationType
+	_bind_address: str
+	_umask: int|None
+	_listen_backlog: int
+	_executor: concurrent.futures.Executor|None
 	
 	
 	def __init__(self,
-			minworkers: int|None = None,
-			maxworkers: int = 100):
-		
-		if minworkers is None:
-			minworkers = os.cpu_count()
-			if minworkers is None:
-				minworkers = 1
-		maxworkers = max(minworkers, maxworkers)
-		self._min_workers = minworkers
-		self._max_workers = maxworkers
-		
-		self._lock = threading.Lock()
-		self._queue_nonempty = threading.Condition(self._lock)
-		self._queue = collections.deque()
-		self._num_workers = 0
-		self._num_idle_workers = 0
+			app: _ApplicationType,
+			bindaddr: str,
+			*,
+			umask: int|None = None,
+			listen_backlog: int = 1000,
+			executor: concurrent.futures.Executor|None = None):
 		
-		self._cleanable = threading.Condition(self._lock)
-		threading.Thread(target=self._cleaner).start()
+		self._application = app
+		self._bind_address = bindaddr
+		self._umask = umask
+		self._listen_backlog = listen_backlog
+		self._executor = executor
 	
 	
-	def _worker(self) -> None:
+	def run(self) -> None:
+		asyncio.run(self.serve())
+	
+	
+	async def serve(self) -> None:
+		pathlib.Path(self._bind_address).unlink(True)
+		oldmask: int|None = None if (self._umask is None) else os.umask(self._umask)
 		try:
+			server: asyncio.Server = await asyncio.start_unix_server(
+				self._handle_connection, self._bind_address, backlog=self._listen_backlog)
+		finally:
+			if oldmask is not None:
+				os.umask(oldmask)
+		async with server:
+			await server.serve_forever()
+	
+	
+	async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+		sock: _StreamWriterSender = _StreamWriterSender(writer, loop)
+		try:
+			req: _Request|None = None
 			while True:
-				with self._lock:
-					self._num_idle_workers += 1
-					if self._num_workers > self._min_workers:
-						self._cleanable.notify()
-					try:
-						while len(self._queue) == 0:
-							self._queue_nonempty.wait()
-						item: Callable[[],None]|None = self._queue.popleft()
-					finally:
-						self._num_idle_workers -= 1
-				if item is None:
+				rc: record.Record|None = await record.Record.read_from_stream_reader(reader)
+				if rc is None:
+					if req is not None:
+						raise EOFError()
 					break
-				else:
-					item()
+				req, ready = _Request._handle_record(self._application, sock, req, rc)
+				if ready:
+					await loop.run_in_executor(self._executor, req._process)
+					keepconn: bool = req._keep_conn
+					req = None
+					if not keepconn:
+						break
+		except (BrokenPipeError, ConnectionResetError):
+			pass
 		finally:
-			with self._lock:
-				self._num_workers -= 1
-	
-	
-	def submit(self, task: Callable[[],None]) -> None:
-		with self._lock:
-			self._queue.append(task)
-			if self._num_idle_workers > 0:
-				self._queue_nonempty.notify()
-			elif self._num_workers < self._max_workers:
-				threading.Thread(target=self._worker).start()
-				self._num_workers += 1
-	
-	
-	def _cleaner(self) -> None:
-		while True:
-			time.sleep(10)
-			with self._lock:
-				if (self._num_workers > self._min_workers) and (self._num_idle_workers > 0):
-					self._queue.append(None)
-					self._queue_nonempty.notify()
-				else:
-					self._cleanable.wait()
+			writer.close()
+			try:
+				await writer.wait_closed()
+			except (BrokenPipeError, ConnectionResetError):
+				pass
+
+
+
+# Prints the exception that ended a connection task, which the executor would otherwise swallow.
+def _report_exception(future: concurrent.futures.Future[None]) -> None:
+	exc: BaseException|None = future.exception()
+	if exc is not None:
+		traceback.print_exception(exc)
+
+
+
+# Lets a worker thread send data through an asyncio stream writer, blocking until the writer has
+# accepted it and its buffer has drained below the high-water mark.
+class _StreamWriterSender:
+	
+	__slots__ = ("_writer", "_loop")
+	_writer: asyncio.StreamWriter
+	_loop: asyncio.AbstractEventLoop
+	
+	
+	def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+		self._writer = writer
+		self._loop = loop
+	
+	
+	# The data is copied because the transport may still hold it after drain() returns
+	# (without copying, since Python 3.12), while callers reuse their buffers right away.
+	def sendall(self, data: bytes) -> None:
+		asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self._loop).result()
+	
+	
+	async def _write(self, data: bytes) -> None:
+		self._writer.write(data)
+		await self._writer.drain()
 
 
 
 class _Request:
 	
+	__slots__ = ("_application", "_id", "_keep_conn", "_writer",
+		"_params", "_stdin", "_headers", "_headers_written")
+	
 	# Immutable
 	_application: _ApplicationType
-	_socket: socket.socket
 	_id: int
 	_keep_conn: bool
+	_writer: record.BufferedRecordWriter
 	
 	# Mutable
-	_params: io.BytesIO
-	_stdin: io.BytesIO
-	_headers: list[str]
+	_params: list[bytes]
+	_stdin: list[bytes]
+	_headers: bytes
 	_headers_written: bool
 	
 	
-	def __init__(self, app: _ApplicationType, sock: socket.socket, rc: record.BeginRequestRecord):
+	def __init__(self, app: _ApplicationType, sock: record.SupportsSendall, rc: record.BeginRequestRecord):
 		self._application = app
-		self._socket = sock
 		self._id = rc.get_request_id()
 		self._keep_conn = rc.get_keep_conn()
-		self._params = io.BytesIO()
-		self._stdin = io.BytesIO()
-		self._headers = []
+		self._writer = record.BufferedRecordWriter(sock)
+		self._params = []
+		self._stdin = []
+		self._headers = b""
 		self._headers_written = False
 	
 	
@@ -219,26 +238,63 @@ class _Request:
 		return self._id
 	
 	
+	# Applies the given record to the connection's current request (if any), returning
+	# the new current request and whether it has received all its input.
+	@staticmethod
+	def _handle_record(app: _ApplicationType, sock: record.SupportsSendall, req: _Request|None, rc: record.Record) -> tuple[_Request,bool]:
+		reqid: int = rc.get_request_id()
+		rctype: type[record.Record] = type(rc)
+		if reqid == 0:
+			raise ValueError("Unknown management record type")
+		elif rctype is record.BeginRequestRecord:
+			if req is not None:
+				raise ValueError("Concurrent request")
+			return (_Request(app, sock, rc), False)
+		elif (req is None) or (reqid != req._id):
+			raise ValueError("Missing request")
+		handler: Callable[[_Request,record.Record],bool]|None = _Request._RECORD_HANDLERS.get(rctype)
+		if handler is None:
+			raise ValueError("Unknown request record type")
+		return (req, handler(req, rc))
+	
+	
+	def _handle_params(self, rc: record.Record) -> bool:
+		self._params.append(rc.get_content())
+		return False
+	
+	
+	def _handle_stdin(self, rc: record.Record) -> bool:
+		b: bytes = rc.get_content()
+		self._stdin.append(b)
+		return len(b) == 0
+	
+	
 	def _process(self) -> None:
-		self._stdin.seek(0)
+		stdin: bytes = b"".join(self._stdin)
+		self._stdin.clear()  # So that a large body is not held twice while the application runs
 		environ: dict[str,object] = {
 			"wsgi.version": (1, 0),
-			"wsgi.input": self._stdin,
+			"wsgi.input": io.BytesIO(stdin),
 			"wsgi.errors": io.StringIO(),
 			"wsgi.multithread": True,
 			"wsgi.multiprocess": False,
 			"wsgi.run_once": False,
 		}
-		environ.update(record.name_values_to_dict(self._params.getvalue()))
+		environ.update(_Request._parse_params(b"".join(self._params)))
 		environ["wsgi.url_scheme"] = environ["REQUEST_SCHEME"]
 		
 		result: Iterable[bytes] = self._application(environ, self._start_response)
 		try:
-			for b in result:
-				self._write_stdout(b)
+			if isinstance(result, (list, tuple)):
+				# All blocks already exist, so the whole response can be sent in one batch
+				for b in result:
+					self._queue_stdout(b)
+			else:
+				for b in result:
+					self._write_stdout(b)
 			self._write_headers()
-			self._send(record.StdoutRecord(self._id, b""))
-			self._send(record.EndRequestRecord(self._id, 0, record.EndRequestRecord.ProtocolStatus.REQUEST_COMPLETE))
+			self._writer.write_bytes(_Request._end_bytes(self._id))
+			self._writer.flush()
 		finally:
 			if hasattr(result, "close"):
 				result.close()
@@ -249,18 +305,35 @@ class _Request:
 			raise ValueError("Headers already written")
 		if (len(self._headers) > 0) and (excinfo is None):
 			raise ValueError("Headers already set")
-		self._headers = ["HTTP/1.0 " + status] + [": ".join(kv) for kv in respheaders] + ["", ""]
+		parts: list[str] = ["HTTP/1.0 ", status, "\r\n"]
+		for (key, val) in respheaders:
+			parts += (key, ": ", val, "\r\n")
+		parts.append("\r\n")
+		self._headers = "".join(parts).encode("ISO-8859-1")
 		return self._write_stdout
 	
 	
+	# Every block from the application is sent before returning, as WSGI requires.
 	def _write_stdout(self, b: bytes) -> None:
-		off: int = 0
-		while off < len(b):
-			self._write_headers()
-			n: int = min(len(b) - off, _Request._RECORD_MAX_DATA_LENGTH)
-			self._send(record.StdoutRecord(self._id,
-				b if (n == len(b)) else b[off : off + n]))
-			off += n
+		self._queue_stdout(b)
+		self._writer.flush()
+	
+	
+	def _queue_stdout(self, b: bytes) -> None:
+		n: int = _Request._RECORD_MAX_DATA_LENGTH
+		if len(b) == 0:
+			return
+		self._write_headers()
+		if len(b) <= n:
+			self._send(record.StdoutRecord(self._id, b))
+			return
+		# Slicing a view does not copy the data. The views are released explicitly so that
+		# the application can resize a bytearray it yielded, even on implementations that
+		# free objects lazily.
+		with memoryview(b) as view:
+			for off in range(0, len(b), n):
+				with view[off : off + n] as part:
+					self._send(record.StdoutRecord(self._id, part))
 	
 	
 	def _write_headers(self) -> None:  # Idempotent
@@ -270,12 +343,48 @@ class _Request:
 			raise ValueError("Headers not set")
 		else:
 			self._headers_written = True
-			self._write_stdout("\r\n".join(self._headers).encode("ISO-8859-1"))
-			self._headers = []
+			self._queue_stdout(self._headers)
+			self._headers = b""
 	
 	
 	def _send(self, rc: record.Record) -> None:
-		rc.send_to_socket(self._socket)
+		self._writer.write(rc)
+	
+	
+	# Web servers often send byte-identical parameters for repeated requests, so parsing is cached.
+	# Parameters carrying credentials or cookies are parsed directly so that no secret outlives its
+	# request in the cache, and large blocks are too so that the cache's memory stays bounded.
+	@staticmethod
+	def _parse_params(b: bytes) -> Iterable[tuple[str,str]]:
+		if (len(b) > _Request._PARAMS_CACHE_MAX_LENGTH) or any((name in b) for name in _Request._PARAMS_UNCACHED_NAMES):
+			return record.name_values_to_dict(b).items()
+		return _Request._parse_params_cached(b)
+	
+	
+	# The result is an immutable sequence of pairs because every request needs its own environ dict.
+	@staticmethod
+	@functools.lru_cache(maxsize=256)
+	def _parse_params_cached(b: bytes) -> tuple[tuple[str,str],...]:
+		return tuple(record.name_values_to_dict(b).items())
+	
+	
+	# Returns the serialized empty Stdout record and EndRequest record that finish a
+	# successful request. Web servers tend to reuse a few request IDs, so this is cached.
+	@staticmethod
+	@functools.lru_cache(maxsize=256)
+	def _end_bytes(reqid: int) -> bytes:
+		return record.StdoutRecord(reqid, b"").to_bytes() \
+			+ record.EndRequestRecord(reqid, 0, record.EndRequestRecord.ProtocolStatus.REQUEST_COMPLETE).to_bytes()
 	
 	
 	_RECORD_MAX_DATA_LENGTH: int = 2**16 - 1
+	
+	_PARAMS_CACHE_MAX_LENGTH: int = 4096
+	
+	_PARAMS_UNCACHED_NAMES: tuple[bytes,...] = (b"HTTP_AUTHORIZATION", b"HTTP_COOKIE")
+	
+	# Each handler returns whether the request is ready to be processed
+	_RECORD_HANDLERS: dict[type[record.Record],Callable[[_Request,record.Record],bool]] = {
+		record.ParamsRecord: _handle_params,
+		record.StdinRecord: _handle_stdin,
+	}